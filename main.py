@@ -1,24 +1,139 @@
 import logging
+import logging.handlers
 import asyncio
+import atexit
+import multiprocessing
+import os
+import queue
+import socket
+import sys
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
-import json
-import binascii
+from fastapi.responses import Response
+import orjson
 import re
-from typing import Any, Optional
+from typing import Any, Optional, Tuple
+
+def _json_default(value):
+    """
+    orjson fallback for values it can't serialize natively
+    """
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    raise TypeError
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formatter that serializes dict/list log arguments with orjson
+    
+    Handlers pass structured data as %s arguments, so the JSON encoding
+    only happens when a record is actually emitted. Output is compact
+    unless pretty is set.
+    """
+    
+    def __init__(self, fmt: Optional[str] = None, pretty: bool = False):
+        super().__init__(fmt)
+        self.json_option = orjson.OPT_INDENT_2 if pretty else 0
+    
+    def format(self, record: logging.LogRecord) -> str:
+        args = record.args
+        if isinstance(args, dict):
+            # logging unwraps a single mapping argument
+            args = (args,)
+        if args:
+            record.args = tuple(self._encode(arg) for arg in args)
+        return super().format(record)
+    
+    def _encode(self, arg):
+        if not isinstance(arg, (dict, list)):
+            return arg
+        try:
+            return orjson.dumps(arg, option=self.json_option, default=_json_default).decode()
+        except orjson.JSONEncodeError:
+            # e.g. nesting deeper than orjson's recursion limit
+            return repr(arg)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves message formatting to the listener thread
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Records are handed to a queue from the event loop; a background listener
+# thread does the formatting and the blocking write to stderr.
+log_queue = queue.SimpleQueue()
+log_stream_handler = logging.StreamHandler()
+log_stream_handler.setFormatter(
+    JSONFormatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        # Pretty-print only for someone watching a terminal
+        pretty=sys.stderr.isatty()
+    )
 )
+log_listener = logging.handlers.QueueListener(
+    log_queue, log_stream_handler, respect_handler_level=False
+)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+logger.addHandler(DeferredQueueHandler(log_queue))
+logger.propagate = False
+
+# Hot paths check this before building any log payload
+_INFO = logger.isEnabledFor
 
 app = FastAPI(title="Request Logger API", version="1.0.0")
 
+# Worker processes for either server: one per CPU this process may run on
+# (honours taskset and docker --cpuset-cpus, unlike os.cpu_count())
+if hasattr(os, 'sched_getaffinity'):
+    WORKERS = len(os.sched_getaffinity(0))
+else:
+    WORKERS = os.cpu_count() or 1
+
 # TCP Server Configuration
 TCP_HOST = "0.0.0.0"
 TCP_PORT = 8000
+TCP_RCVBUF = 1 << 20  # bytes
+
+
+# Clients are sent a notice after this long without data
+TCP_IDLE_TIMEOUT = 30.0  # seconds
+
+# Fixed TCP responses, encoded once
+_WELCOME = "Connected to Enhanced TCP Logger Server - Send any data!\n".encode('utf-8')
+_TIMEOUT = "No data received in 30 seconds. Connection still open.\n".encode('utf-8')
+_ACK_PREFIX = "✓ Logged ".encode('utf-8')
+
+# Patterns used by protocol detection, compiled once
+_EMAIL_RE = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b')
+_URL_RE = re.compile(r'https?://[^\s]+')
+
+# Binary magic numbers keyed on their first byte, so detection only
+# compares against the signatures that can possibly match
+_MAGICS = {
+    b'\x89': [(b'\x89PNG\r\n\x1a\n', "png")],
+    b'\xff': [(b'\xff\xd8\xff', "jpeg")],
+    b'G': [(b'GIF8', "gif")],
+    b'%': [(b'%PDF', "pdf")],
+    b'P': [(b'PK\x03\x04', "zip")],
+    b'\x1f': [(b'\x1f\x8b', "gzip")],
+    b'B': [(b'BM', "bmp")],
+    b'R': [(b'RIFF', "wav")],
+    b'\x00': [(b'\x00\x00\x00\x18ftypmp4', "mp4"), (b'\x00\x00\x00\x1cftyp', "mp4")],
+}
+
+# Extra checks for magics short enough to collide with plain text
+_MAGIC_CHECKS = {
+    # RIFF is a container; only WAVE payloads count as wav
+    "wav": lambda data: b'WAVE' in data[:12],
+    # "BM" alone would match text; BMP headers have zeroed reserved bytes
+    "bmp": lambda data: data[6:10] == b'\x00\x00\x00\x00',
+}
 
 class DataProcessor:
     """
@@ -30,93 +145,98 @@ class DataProcessor:
         """
         Try to decode bytes as text using various encodings
         """
-        encodings = ['utf-8', 'ascii', 'latin-1', 'cp1252', 'iso-8859-1']
-        
-        for encoding in encodings:
-            try:
-                return data.decode(encoding)
-            except UnicodeDecodeError:
-                continue
-        return None
+        # UTF-8 covers ASCII, and latin-1 maps every byte, so any other
+        # encoding after it could never be reached. str() rather than
+        # .decode() so memoryview slices work without a copy.
+        try:
+            return str(data, 'utf-8')
+        except UnicodeDecodeError:
+            return str(data, 'latin-1')
     
     @staticmethod
-    def detect_protocol(data: bytes) -> str:
+    def detect_protocol(data: bytes) -> Tuple[str, Optional[str]]:
         """
         Attempt to detect the protocol/format of the data
+        
+        Returns the protocol together with the decoded text (None for
+        empty data and binary formats) so callers don't have to decode the
+        data again.
+        Accepts bytes or a memoryview.
         """
         if not data:
-            return "empty"
+            return "empty", None
         
-        # Try to decode as text first
+        # Binary format detection runs first: a prefix compare is far
+        # cheaper than decoding, and binary data would decode as latin-1.
+        # Every magic and its check fits in the first 16 bytes.
+        head = bytes(data[:16])
+        for prefix, label in _MAGICS.get(head[:1], ()):
+            if head.startswith(prefix):
+                check = _MAGIC_CHECKS.get(label)
+                if check is None or check(head):
+                    return label, None
+        
+        # Decoding never fails (latin-1 accepts any byte sequence)
         text = DataProcessor.try_decode_text(data)
-        if text:
-            text_lower = text.lower().strip()
-            
-            # HTTP detection
-            if text_lower.startswith(('get ', 'post ', 'put ', 'delete ', 'head ', 'options ', 'patch ')):
-                return "http"
-            
-            # JSON detection
-            if text_lower.startswith(('{', '[')):
-                try:
-                    json.loads(text)
-                    return "json"
-                except:
-                    pass
-            
-            # XML detection
-            if text_lower.startswith('<?xml') or text_lower.startswith('<'):
-                return "xml"
-            
-            # Email detection
-            if re.search(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', text):
-                return "email"
-            
-            # URL detection
-            if re.search(r'https?://[^\s]+', text):
-                return "url"
-            
-            # CSV detection
-            if ',' in text and '\n' in text:
-                lines = text.split('\n')
-                if len(lines) > 1 and all(',' in line for line in lines[:3] if line.strip()):
-                    return "csv"
-            
-            return "text"
+        text_lower = text.lower().strip()
         
-        # Binary format detection
-        if data.startswith(b'\x89PNG\r\n\x1a\n'):
-            return "png"
-        elif data.startswith(b'\xff\xd8\xff'):
-            return "jpeg"
-        elif data.startswith(b'GIF8'):
-            return "gif"
-        elif data.startswith(b'%PDF'):
-            return "pdf"
-        elif data.startswith(b'PK\x03\x04'):
-            return "zip"
-        elif data.startswith(b'\x1f\x8b'):
-            return "gzip"
-        elif data.startswith(b'BM'):
-            return "bmp"
-        elif data.startswith(b'RIFF') and b'WAVE' in data[:12]:
-            return "wav"
-        elif data.startswith(b'\x00\x00\x00\x18ftypmp4') or data.startswith(b'\x00\x00\x00\x1cftyp'):
-            return "mp4"
-        else:
-            return "binary"
+        # HTTP detection
+        if text_lower.startswith(('get ', 'post ', 'put ', 'delete ', 'head ', 'options ', 'patch ')):
+            return "http", text
+        
+        # JSON detection
+        if text_lower.startswith(('{', '[')):
+            try:
+                orjson.loads(text)
+                return "json", text
+            except:
+                pass
+        
+        # XML detection
+        if text_lower.startswith('<?xml') or text_lower.startswith('<'):
+            return "xml", text
+        
+        # Email detection
+        if _EMAIL_RE.search(text):
+            return "email", text
+        
+        # URL detection
+        if _URL_RE.search(text):
+            return "url", text
+        
+        # CSV detection
+        if ',' in text and '\n' in text:
+            lines = text.split('\n')
+            if len(lines) > 1 and all(',' in line for line in lines[:3] if line.strip()):
+                return "csv", text
+        
+        return "text", text
+    
+    @staticmethod
+    def sample_protocols(data: bytes, sample_size: int = 1024, max_samples: int = 10) -> list:
+        """
+        Detect the protocols in the leading samples of a large buffer
+        
+        Stops early once three distinct protocols have been seen.
+        """
+        seen = set()
+        # Released on exit so the caller can resize a bytearray afterwards
+        with memoryview(data) as view:
+            for i in range(0, min(len(view), sample_size * max_samples), sample_size):
+                seen.add(DataProcessor.detect_protocol(view[i:i + sample_size])[0])
+                if len(seen) >= 3:
+                    break
+        return list(seen)
     
     @staticmethod
-    def format_binary_data(data: bytes, max_bytes: int = 64) -> str:
+    def format_binary_data(data: bytes, max_bytes: int = 32) -> str:
         """
         Format binary data for logging with hex dump
         """
-        if len(data) <= max_bytes:
-            hex_dump = binascii.hexlify(data).decode('ascii')
-            return f"hex: {hex_dump}"
-        else:
-            hex_dump = binascii.hexlify(data[:max_bytes]).decode('ascii')
-            return f"hex (first {max_bytes} bytes): {hex_dump}... (total: {len(data)} bytes)"
+        size = len(data)
+        if size <= max_bytes:
+            return f"hex: {data.hex()}"
+        return f"hex (first {max_bytes} bytes): {data[:max_bytes].hex()}... (total: {size} bytes)"
     
     @staticmethod
     def process_data(data: bytes) -> dict:
@@ -126,7 +246,7 @@ class DataProcessor:
         if not data:
             return {"type": "empty", "message": "No data received"}
         
-        protocol = DataProcessor.detect_protocol(data)
+        protocol, text = DataProcessor.detect_protocol(data)
         result = {
             "type": protocol,
             "size": len(data),
@@ -134,12 +254,11 @@ class DataProcessor:
         }
         
         if protocol in ["text", "json", "xml", "http", "email", "url", "csv"]:
-            text = DataProcessor.try_decode_text(data)
             if text:
                 result["content"] = text
                 if protocol == "json":
                     try:
-                        result["parsed_json"] = json.loads(text)
+                        result["parsed_json"] = orjson.loads(text)
                     except:
                         pass
         else:
@@ -147,151 +266,235 @@ class DataProcessor:
             
         return result
 
-async def handle_tcp_client(reader, writer):
+class TCPLoggerProtocol(asyncio.Protocol):
     """
-    Enhanced TCP client handler that accepts every sort of data
+    Enhanced TCP protocol that accepts every sort of data
+    
+    Received chunks are handed over directly by the event loop in
+    data_received, without an intermediate StreamReader read() per chunk.
     """
-    client_addr = writer.get_extra_info('peername')
-    logger.info(f"TCP client connected from {client_addr}")
     
-    try:
-        # Send welcome message
-        welcome_msg = "Connected to Enhanced TCP Logger Server - Send any data!\n"
-        writer.write(welcome_msg.encode('utf-8'))
-        await writer.drain()
+    def connection_made(self, transport):
+        self.transport = transport
+        self.client_addr = transport.get_extra_info('peername')
+        logger.info("TCP client connected from %s", self.client_addr)
+        
+        # ACK immediately instead of waiting on Nagle/delayed ACK, and give
+        # bursts enough kernel buffer to arrive in one read
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, TCP_RCVBUF)
+            if hasattr(socket, 'TCP_QUICKACK'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
         
         # Buffer for accumulating data
-        data_buffer = b""
-        message_count = 0
+        self.data_buffer = bytearray()
+        self.message_count = 0
         
-        while True:
-            try:
-                # Read data from client with timeout
-                data = await asyncio.wait_for(reader.read(4096), timeout=30.0)
-                
-                if not data:
-                    logger.info(f"TCP client {client_addr} closed connection")
-                    break
-                
-                # Add to buffer
-                data_buffer += data
-                message_count += 1
-                
-                # Process the data
-                processed_data = DataProcessor.process_data(data)
-                
-                # Log the processed data
+        # Responses are sent at the end of the current loop iteration, so
+        # all ACKs from one read burst go out in a single write
+        self.pending: list[bytes] = []
+        self.send_scheduled = False
+        
+        self.loop = asyncio.get_running_loop()
+        self.last_data_time = self.loop.time()
+        self.timeout_handle = self.loop.call_later(TCP_IDLE_TIMEOUT, self._check_idle)
+        
+        # Send welcome message
+        self.queue_response(_WELCOME)
+    
+    def data_received(self, data: bytes):
+        try:
+            self.last_data_time = self.loop.time()
+            
+            # Add to buffer
+            self.data_buffer.extend(data)
+            self.message_count += 1
+            
+            # Process the data
+            processed_data = DataProcessor.process_data(data)
+            
+            # Log the processed data
+            # (encoded by JSONFormatter on the listener thread, so a payload
+            # that can't be serialized never affects the connection)
+            if _INFO(logging.INFO):
                 log_entry = {
-                    "client": str(client_addr),
-                    "message_number": message_count,
+                    "client": str(self.client_addr),
+                    "message_number": self.message_count,
                     "data": processed_data
                 }
-                
-                logger.info(f"TCP Data: {json.dumps(log_entry, indent=2)}")
-                
-                # Send acknowledgment back to client
-                ack_msg = f"✓ Logged {processed_data['type']} data ({processed_data['size']} bytes) - Message #{message_count}\n"
-                writer.write(ack_msg.encode('utf-8'))
-                await writer.drain()
-                
-                # If we've accumulated a lot of data, log buffer summary
-                if len(data_buffer) > 1024 * 1024:  # 1MB
+                logger.info("TCP Data: %s", log_entry)
+            
+            # Queue acknowledgment back to client
+            ack = b"".join((
+                _ACK_PREFIX, processed_data['type'].encode('ascii'),
+                b" data (", str(processed_data['size']).encode('ascii'),
+                b" bytes) - Message #", str(self.message_count).encode('ascii'), b"\n"
+            ))
+            self.queue_response(ack)
+            
+            # If we've accumulated a lot of data, log buffer summary
+            if len(self.data_buffer) > 1024 * 1024:  # 1MB
+                if _INFO(logging.INFO):
                     buffer_summary = {
-                        "client": str(client_addr),
+                        "client": str(self.client_addr),
                         "buffer_summary": {
-                            "total_size": len(data_buffer),
-                            "message_count": message_count,
-                            "protocols_detected": list(set([DataProcessor.detect_protocol(chunk) for chunk in [data_buffer[i:i+1024] for i in range(0, min(len(data_buffer), 10240), 1024)]]))
+                            "total_size": len(self.data_buffer),
+                            "message_count": self.message_count,
+                            "protocols_detected": DataProcessor.sample_protocols(self.data_buffer)
                         }
                     }
-                    logger.info(f"TCP Buffer Summary: {json.dumps(buffer_summary, indent=2)}")
-                    # Reset buffer to prevent memory issues
-                    data_buffer = b""
-                
-            except asyncio.TimeoutError:
-                logger.info(f"TCP client {client_addr} timeout - no data received in 30 seconds")
-                timeout_msg = "No data received in 30 seconds. Connection still open.\n"
-                writer.write(timeout_msg.encode('utf-8'))
-                await writer.drain()
-                continue
-                
-            except Exception as read_error:
-                logger.error(f"Error reading from TCP client {client_addr}: {read_error}")
-                break
-                
-    except asyncio.CancelledError:
-        logger.info(f"TCP client {client_addr} connection cancelled")
-    except Exception as e:
-        logger.error(f"TCP client {client_addr} error: {e}")
-    finally:
+                    logger.info("TCP Buffer Summary: %s", buffer_summary)
+                # Reset buffer in place to prevent memory issues
+                del self.data_buffer[:]
+        
+        except Exception as read_error:
+            logger.error("Error reading from TCP client %s: %s", self.client_addr, read_error)
+            self.transport.close()
+    
+    def eof_received(self):
+        logger.info("TCP client %s closed connection", self.client_addr)
+        # Returning None lets the transport close itself
+    
+    def connection_lost(self, exc):
+        self.timeout_handle.cancel()
+        
+        if exc is not None:
+            logger.error("TCP client %s error: %s", self.client_addr, exc)
+        
+        # The socket is gone, so queued responses are dropped
+        self.pending.clear()
+        
         # Log final session summary
-        if message_count > 0:
+        if self.message_count > 0:
             session_summary = {
-                "client": str(client_addr),
+                "client": str(self.client_addr),
                 "session_summary": {
-                    "total_messages": message_count,
-                    "total_data_size": len(data_buffer),
+                    "total_messages": self.message_count,
+                    "total_data_size": len(self.data_buffer),
                     "session_duration": "ended"
                 }
             }
-            logger.info(f"TCP Session Summary: {json.dumps(session_summary, indent=2)}")
+            logger.info("TCP Session Summary: %s", session_summary)
         
-        logger.info(f"TCP client {client_addr} disconnected")
-        try:
-            writer.close()
-            await writer.wait_closed()
-        except:
-            pass
+        logger.info("TCP client %s disconnected", self.client_addr)
+    
+    def pause_writing(self):
+        # Stop reading while the client isn't consuming our ACKs
+        self.transport.pause_reading()
+    
+    def resume_writing(self):
+        self.transport.resume_reading()
+    
+    def queue_response(self, data: bytes):
+        """
+        Queue data for the client, sent once the current loop iteration ends
+        """
+        self.pending.append(data)
+        if not self.send_scheduled:
+            self.send_scheduled = True
+            self.loop.call_soon(self.send_pending)
+    
+    def send_pending(self):
+        """
+        Write out queued responses
+        """
+        self.send_scheduled = False
+        if self.pending and not self.transport.is_closing():
+            # One vectored write for everything queued since the last send
+            self.transport.writelines(self.pending)
+        self.pending.clear()
+    
+    def _check_idle(self):
+        idle = self.loop.time() - self.last_data_time
+        if idle >= TCP_IDLE_TIMEOUT:
+            logger.info("TCP client %s timeout - no data received in 30 seconds", self.client_addr)
+            self.queue_response(_TIMEOUT)
+            self.last_data_time = self.loop.time()
+            idle = 0
+        self.timeout_handle = self.loop.call_later(TCP_IDLE_TIMEOUT - idle, self._check_idle)
 
 async def start_tcp_server():
     """
     Start the TCP server
     """
-    server = await asyncio.start_server(
-        handle_tcp_client,
+    # SO_REUSEPORT lets every worker process bind the same port; the kernel
+    # balances new connections between them
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(
+        TCPLoggerProtocol,
         TCP_HOST,
-        TCP_PORT
+        TCP_PORT,
+        reuse_port=True,
+        backlog=2048
     )
     
-    logger.info(f"TCP server started on {TCP_HOST}:{TCP_PORT}")
+    logger.info("TCP server started on %s:%s", TCP_HOST, TCP_PORT)
     
     async with server:
         await server.serve_forever()
 
-@app.get("/test_get")
-async def test(request: Request):
+def run_tcp_worker():
     """
-    Root endpoint with API information
+    Run one TCP server worker process on uvloop
     """
+    import uvloop
     
-    # Log headers in JSON format
-    headers_dict = dict(request.headers)
-    logger.info(f"Headers: {json.dumps(headers_dict, indent=2)}")
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    asyncio.run(start_tcp_server())
+
+def log_headers(label: str, headers) -> None:
+    """
+    Log the raw header list as compact JSON, skipping the work entirely
+    when INFO logging is disabled
+    """
+    if _INFO(logging.INFO):
+        logger.info("%s: %s", label, headers.raw)
+
+async def log_body(request: Request) -> None:
+    """
+    Log the request body, parsed as JSON when possible; the body isn't
+    even read when INFO logging is disabled
+    """
+    if not _INFO(logging.INFO):
+        return
     
-    # Log body in JSON format
     try:
         body = await request.body()
-        body_str = body.decode('utf-8') if body else ""
-        if body_str:
+        if body:
             try:
                 # Try to parse as JSON for pretty printing
-                body_json = json.loads(body_str)
-                logger.info(f"Body: {json.dumps(body_json, indent=2)}")
-            except json.JSONDecodeError:
+                body_json = orjson.loads(body)
+                logger.info("Body: %s", body_json)
+            except orjson.JSONDecodeError:
                 # If not valid JSON, log as string
-                logger.info(f"Body: {json.dumps({'raw_body': body_str}, indent=2)}")
+                logger.info("Body: %s", {'raw_body': body.decode('utf-8')})
         else:
-            logger.info(f"Body: {json.dumps({'body': 'empty'}, indent=2)}")
+            logger.info("Body: %s", {'body': 'empty'})
     except Exception as e:
-        logger.error(f"Error reading body: {e}")
-        logger.info(f"Body: {json.dumps({'error': 'Could not read body'}, indent=2)}")
+        logger.error("Error reading body: %s", e)
+        logger.info("Body: %s", {'error': 'Could not read body'})
+
+@app.get("/test_get")
+async def test(request: Request):
+    """
+    Root endpoint with API information
+    """
     
-    return JSONResponse(
-        content={
+    # Log headers in JSON format
+    log_headers("Headers", request.headers)
+    
+    # Log body in JSON format
+    await log_body(request)
+    
+    return Response(
+        content=orjson.dumps({
             "message": "Request Logger API is running",
             "version": "1.0.0",
             "description": "Send any request to any path and it will be logged",
-        }
+        }),
+        media_type="application/json"
     )
 
 @app.post("/test_post")
@@ -300,36 +503,21 @@ async def catch_all_post(request: Request):
     POST endpoint that logs all headers and body data
     """
     
-    logger.info(f"POST request to /test_post")
+    logger.info("POST request to /test_post")
     
     # Log headers in JSON format
-    headers_dict = dict(request.headers)
-    logger.info(f"Headers: {json.dumps(headers_dict, indent=2)}")
+    log_headers("Headers", request.headers)
     
     # Log body in JSON format
-    try:
-        body = await request.body()
-        body_str = body.decode('utf-8') if body else ""
-        if body_str:
-            try:
-                # Try to parse as JSON for pretty printing
-                body_json = json.loads(body_str)
-                logger.info(f"Body: {json.dumps(body_json, indent=2)}")
-            except json.JSONDecodeError:
-                # If not valid JSON, log as string
-                logger.info(f"Body: {json.dumps({'raw_body': body_str}, indent=2)}")
-        else:
-            logger.info(f"Body: {json.dumps({'body': 'empty'}, indent=2)}")
-    except Exception as e:
-        logger.error(f"Error reading body: {e}")
-        logger.info(f"Body: {json.dumps({'error': 'Could not read body'}, indent=2)}")
+    await log_body(request)
     
-    return JSONResponse(
-        content={
+    return Response(
+        content=orjson.dumps({
             "message": "POST request to /test_post logged successfully",
             "path": "/test_post",
             "status": "logged"
-        }
+        }),
+        media_type="application/json"
     )
 
 @app.websocket("/test_ws")
@@ -341,60 +529,81 @@ async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     
     # Log connection headers
-    headers_dict = dict(websocket.headers)
-    logger.info(f"WebSocket connection established")
-    logger.info(f"WebSocket Headers: {json.dumps(headers_dict, indent=2)}")
+    logger.info("WebSocket connection established")
+    log_headers("WebSocket Headers", websocket.headers)
     
     try:
         while True:
-            # Receive message (can be text or bytes)
-            try:
-                # Try to receive as text first
-                message = await websocket.receive_text()
-                logger.info(f"WebSocket Text Message: {json.dumps({'type': 'text', 'message': message}, indent=2)}")
+            # Receive message (can be text or bytes) and dispatch on its contents
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            
+            text = message.get("text")
+            data = message.get("bytes")
+            
+            if text is not None:
+                try:
+                    parsed = orjson.loads(text)
+                except orjson.JSONDecodeError:
+                    logger.info("WebSocket Text Message: %s", {'type': 'text', 'message': text})
+                else:
+                    logger.info("WebSocket JSON Message: %s", {'type': 'json', 'message': parsed})
                 
                 # Echo back the message with confirmation
-                await websocket.send_text(f"Logged: {message}")
+                await websocket.send_text(f"Logged: {text}")
+            
+            elif data is not None:
+                message_str = data.decode('utf-8', errors='ignore')
+                logger.info("WebSocket Bytes Message: %s", {'type': 'bytes', 'message': message_str, 'length': len(data)})
                 
-            except:
-                # If text fails, try bytes
-                try:
-                    message = await websocket.receive_bytes()
-                    message_str = message.decode('utf-8', errors='ignore')
-                    logger.info(f"WebSocket Bytes Message: {json.dumps({'type': 'bytes', 'message': message_str, 'length': len(message)}, indent=2)}")
-                    
-                    # Echo back confirmation
-                    await websocket.send_text(f"Logged bytes message of length: {len(message)}")
-                    
-                except:
-                    # Handle JSON messages or other formats
-                    try:
-                        message = await websocket.receive_json()
-                        logger.info(f"WebSocket JSON Message: {json.dumps({'type': 'json', 'message': message}, indent=2)}")
-                        
-                        # Echo back the JSON
-                        await websocket.send_json({"status": "logged", "original_message": message})
-                        
-                    except Exception as e:
-                        logger.error(f"Error receiving WebSocket message: {e}")
-                        break
+                # Echo back confirmation
+                await websocket.send_text(f"Logged bytes message of length: {len(data)}")
                         
     except WebSocketDisconnect:
         logger.info("WebSocket client disconnected")
     except Exception as e:
-        logger.error(f"WebSocket error: {e}")
+        logger.error("WebSocket error: %s", e)
 
 if __name__ == "__main__":
     import uvicorn
     
-    async def main():
+    def run_http_server():
+        """
+        Run the FastAPI app on port 8000
+        """
+        # The endpoints already log every request, so uvicorn's own access
+        # log and logging config are skipped
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8000,
+            access_log=False,
+            log_level="warning",
+            log_config=None,
+            loop="uvloop",
+            http="httptools",
+            ws="websockets",
+            lifespan="off",
+            workers=WORKERS,
+        )
+    
+    def main():
         """
-        Run TCP server on port 8000
+        Run TCP server on port 8000 in WORKERS processes
         """
-        logger.info("Starting TCP server on port 8000...")
+        logger.info("Starting TCP server on port 8000 with %s workers...", WORKERS)
         
-        # Start only the TCP server
-        await start_tcp_server()
+        # Spawned (not forked) workers import this module fresh, so each one
+        # starts its own log listener thread
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=run_tcp_worker) for _ in range(WORKERS)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
     
-    # Run the main async function
-    asyncio.run(main()) 
\ No newline at end of file
+    if sys.argv[1:] == ["http"]:
+        run_http_server()
+    else:
+        main() 
\ No newline at end of file
@@ -3,93 +3,469 @@
 Test script to simulate 3cx call flow designer socket component behavior
 """
 
+import argparse
+import asyncio
+import functools
+import os
+import re
+import selectors
 import socket
+import sys
 import json
 import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
 
-def test_tcp_connection():
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+HOST = "localhost"
+PORT = 8001
+
+@functools.lru_cache(maxsize=None)
+def resolve_addr() -> tuple:
     """
-    Test TCP connection to simulate 3cx socket component
+    Resolve HOST:PORT on first use only, so connecting never goes through
+    getaddrinfo again and a lookup failure surfaces where it's handled
     """
-    host = "localhost"
-    port = 8001
-    
-    # Sample call flow data
-    test_data = {
+    return socket.getaddrinfo(HOST, PORT, socket.AF_INET, socket.SOCK_STREAM)[0][4]
+
+# Start of the greeting the TCP logger server sends on connect
+WELCOME_PREFIX = b"Connected to Enhanced TCP Logger Server"
+
+# Size field of the server's ACK lines; the server sends one ACK per read,
+# so a request that arrives in two reads is acknowledged in two parts
+ACK_SIZE_RE = re.compile(rb"\((\d+) bytes\) - Message #")
+
+# Sized up front (before connect) so short sessions don't wait on autotuning
+SOCKET_BUFFER_SIZE = 256 * 1024
+
+def new_socket() -> socket.socket:
+    """
+    Create a TCP socket with the send/receive buffers already sized
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+    return sock
+
+def sample_call_data() -> dict:
+    """
+    Sample call flow data, as a 3cx socket component would send it
+    """
+    return {
         "call_id": "12345",
         "caller_number": "+1234567890",
         "called_number": "+0987654321",
         "action": "incoming_call",
-        "timestamp": time.time(),
+        # Integer nanoseconds since the epoch
+        "timestamp": time.time_ns(),
         "extension": "101",
         "caller_name": "John Doe"
     }
+
+async def open_test_socket(addr: tuple) -> socket.socket:
+    """
+    Connect a non-blocking TCP socket for use with the event loop
+    """
+    loop = asyncio.get_running_loop()
+    sock = new_socket()
+    sock.setblocking(False)
+    try:
+        await loop.sock_connect(sock, addr)
+    except BaseException:
+        sock.close()
+        raise
+    # Push each request out immediately instead of letting Nagle hold it
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+async def recv_lines(sock, buf: bytearray, count: int) -> list:
+    """
+    Receive until count newline-terminated lines have arrived and return a
+    view of each
+    
+    Lines that arrive together are read with a single recv, so the welcome
+    and the response often cost one call. Missing lines come back as empty
+    views. The views are only valid until the buffer is reused.
+    """
+    loop = asyncio.get_running_loop()
+    view = memoryview(buf)
+    size = 0
+    while buf.count(b'\n', 0, size) < count and size < len(buf):
+        n = await loop.sock_recv_into(sock, view[size:])
+        if not n:
+            break
+        size += n
+    
+    lines = []
+    start = 0
+    while len(lines) < count:
+        end = buf.find(b'\n', start, size)
+        if end == -1:
+            lines.append(view[start:size])
+            start = size
+        else:
+            lines.append(view[start:end + 1])
+            start = end + 1
+    return lines
+
+def as_text(data) -> str:
+    """
+    Decode received bytes for printing, with surrounding whitespace removed
+    """
+    return str(data, 'utf-8', 'replace').strip()
+
+def encode_json(data) -> bytes:
+    """
+    Encode data as compact JSON bytes, using orjson when it's installed
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+def decode_json(raw):
+    """
+    Decode JSON from str, bytes or memoryview, using orjson when it's installed
+    """
+    if orjson is not None:
+        return orjson.loads(raw)
+    if isinstance(raw, memoryview):
+        raw = raw.tobytes()
+    return json.loads(raw)
+
+def pretty_json(data) -> str:
+    """
+    Format data as indented JSON for printing
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode('utf-8')
+    return json.dumps(data, indent=2)
+
+# The sample call data is encoded once, split around the timestamp so each
+# request only has to format that one value
+_CALL_PREFIX, _CALL_SUFFIX = encode_json(
+    {**sample_call_data(), "timestamp": "__timestamp__"}
+).split(b'"__timestamp__"')
+
+def call_payload() -> bytes:
+    """
+    Encoded sample call data carrying the current timestamp
+    """
+    return _CALL_PREFIX + str(time.time_ns()).encode('ascii') + _CALL_SUFFIX
+
+class RunLog:
+    """
+    Collects test output while the socket exchanges run and writes it all
+    out afterwards, so terminal I/O stays off the timed path
+    
+    Values are formatted only at write time: bytes are decoded, parsed JSON
+    is pretty-printed.
+    """
+    
+    def __init__(self):
+        self.start_ns = time.perf_counter_ns()
+        self.entries = []
+    
+    def add(self, label: str, value=None):
+        self.entries.append((time.perf_counter_ns(), label, value))
+    
+    def write(self):
+        lines = []
+        for t_ns, label, value in self.entries:
+            line = f"[+{(t_ns - self.start_ns) / 1e6:8.3f} ms] {label}"
+            if isinstance(value, bytes):
+                line += f": {as_text(value)}"
+            elif isinstance(value, str):
+                line += f": {value}"
+            elif value is not None:
+                line += f": {pretty_json(value)}"
+            lines.append(line)
+        sys.stdout.write("\n".join(lines) + "\n")
+
+async def test_tcp_connection(sock, buf: bytearray, log: RunLog):
+    """
+    Test TCP connection to simulate 3cx socket component
+    
+    Runs first on a fresh connection, so the welcome message is read
+    together with the response.
+    """
+    loop = asyncio.get_running_loop()
     
     try:
-        # Create socket connection (similar to 3cx socket component)
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.connect((host, port))
-            print(f"Connected to {host}:{port}")
-            
-            # Receive welcome message
-            welcome = sock.recv(1024).decode('utf-8')
-            print(f"Welcome message: {welcome.strip()}")
-            
-            # Send JSON data (as 3cx would)
-            message = json.dumps(test_data)
-            sock.send(message.encode('utf-8'))
-            print(f"Sent: {message}")
-            
-            # Wait for response (WaitForResponse = True)
-            response = sock.recv(1024).decode('utf-8')
-            print(f"Response: {response.strip()}")
+        # Send JSON data (as 3cx would) without waiting for the welcome
+        # One compact buffer, handed to the kernel in a single sendall()
+        payload = call_payload()
+        await loop.sock_sendall(sock, payload)
+        log.add("Sent", payload)
+        
+        # Receive welcome message and wait for response (WaitForResponse = True)
+        welcome, response = await recv_lines(sock, buf, 2)
+        # Copied out: the views are only valid until buf is reused
+        welcome, response = bytes(welcome), bytes(response)
+        log.add("Welcome message", welcome)
+        # A plain prefix compare; the greeting carries no fields to parse
+        if not welcome.startswith(WELCOME_PREFIX):
+            log.add("Warning", "unexpected welcome message, is this the TCP logger server?")
+        log.add("Response", response)
+        
+        # Parse response
+        try:
+            log.add("Parsed response", decode_json(response))
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError
+        except json.JSONDecodeError:
+            log.add("Plain text response", response)
             
-            # Parse response
-            try:
-                response_data = json.loads(response.strip())
-                print(f"Parsed response: {json.dumps(response_data, indent=2)}")
-            except json.JSONDecodeError:
-                print(f"Plain text response: {response}")
-                
-    except Exception as e:
-        print(f"Error: {e}")
+    # Connection, send and receive failures (timeouts included) are OSErrors
+    except OSError as e:
+        log.add("Error", str(e))
 
-def test_plain_text():
+async def test_plain_text(sock, buf: bytearray, log: RunLog):
     """
     Test plain text message
     """
-    host = "localhost"
-    port = 8001
+    loop = asyncio.get_running_loop()
     
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.connect((host, port))
-            print(f"Connected to {host}:{port}")
-            
-            # Receive welcome message
-            welcome = sock.recv(1024).decode('utf-8')
-            print(f"Welcome message: {welcome.strip()}")
-            
-            # Send plain text
-            message = "Hello from 3cx call flow test"
-            sock.send(message.encode('utf-8'))
-            print(f"Sent: {message}")
-            
-            # Wait for response
-            response = sock.recv(1024).decode('utf-8')
-            print(f"Response: {response.strip()}")
+        # Send plain text
+        message = "Hello from 3cx call flow test"
+        await loop.sock_sendall(sock, message.encode('utf-8'))
+        log.add("Sent", message)
+        
+        # Wait for response
+        response, = await recv_lines(sock, buf, 1)
+        log.add("Response", bytes(response))
+        
+    except OSError as e:
+        log.add("Error", str(e))
+
+async def run_tests(sock, log: RunLog):
+    """
+    Run both tests in turn over one connected socket
+    """
+    buf = bytearray(4096)
+    
+    log.add("1. Testing JSON call flow data")
+    await test_tcp_connection(sock, buf, log)
+    
+    log.add("2. Testing plain text message")
+    await test_plain_text(sock, buf, log)
+
+def wait_for_lines(sock, buf: bytearray, count: int) -> int:
+    """
+    Block until count newline-terminated lines have been received; returns
+    how many arrived before the connection closed
+    """
+    seen = 0
+    while seen < count:
+        n = sock.recv_into(buf)
+        if not n:
+            break
+        seen += buf.count(b'\n', 0, n)
+    return seen
+
+def tune_for_timing(cpu: Optional[int], fifo: bool):
+    """
+    Optionally pin the calling process to one CPU and request real-time
+    scheduling, keeping migrations and scheduler jitter out of the latency
+    numbers
+    
+    Linux only; SCHED_FIFO is skipped when the process isn't permitted it.
+    """
+    if sys.platform != 'linux':
+        return
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    if fifo:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(50))
+        except PermissionError:
+            pass
+
+def run_rounds(socks: list, payload: bytes, n_requests: int, buf: bytearray) -> Tuple[int, list]:
+    """
+    Inner load loop: send payload n_requests times across socks, one request
+    per connection per round
+    
+    The sockets are switched to non-blocking and watched with a selector,
+    so ACKs are read in whatever order they arrive. A request counts as
+    acknowledged once the byte counts in its connection's ACK lines cover
+    everything sent on it, so a request the server read in two parts is
+    never matched to the next round's send. Returns the number of requests
+    acknowledged and each one's latency in nanoseconds, measured from just
+    before the send to the readable event that completed its ACK.
+    """
+    selector = selectors.DefaultSelector()
+    for sock in socks:
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+    
+    # Per connection: received bytes not yet ending in a newline, and the
+    # payload bytes acknowledged so far
+    partial = {sock: bytearray() for sock in socks}
+    acked_bytes = dict.fromkeys(socks, 0)
+    sent_bytes = 0
+    
+    # Bound once outside the loops
+    select = selector.select
+    now = time.perf_counter_ns
+    find_sizes = ACK_SIZE_RE.findall
+    view = memoryview(buf)
+    acked = 0
+    latencies = []
+    remaining = n_requests
+    try:
+        while remaining > 0:
+            batch = socks[:remaining]
+            sent_at = {}
+            sent_bytes += len(payload)
+            for sock in batch:
+                sent_at[sock] = now()
+                sock.sendall(payload)
             
-    except Exception as e:
-        print(f"Error: {e}")
+            while sent_at:
+                for key, _ in select():
+                    readable_at = now()
+                    sock = key.fileobj
+                    n = sock.recv_into(buf)
+                    if not n:
+                        return acked, latencies
+                    data = partial[sock]
+                    data += view[:n]
+                    end = data.rfind(b'\n') + 1
+                    if not end:
+                        continue
+                    acked_bytes[sock] += sum(map(int, find_sizes(data, 0, end)))
+                    del data[:end]
+                    if sock in sent_at and acked_bytes[sock] >= sent_bytes:
+                        latencies.append(readable_at - sent_at.pop(sock))
+                        acked += 1
+            remaining -= len(batch)
+    finally:
+        selector.close()
+    return acked, latencies
 
-if __name__ == "__main__":
-    print("Testing 3cx Call Flow Integration")
-    print("=" * 40)
+def load_worker(n_requests: int, addr: tuple, connections: int,
+                cpu: Optional[int], fifo: bool) -> Tuple[int, list]:
+    """
+    Send n_requests over a pool of persistent connections and return the
+    number of acknowledgements received with the per-request latencies
     
-    print("\n1. Testing JSON call flow data:")
-    test_tcp_connection()
+    Each round sends one request on every connection before reading the
+    ACKs, so the requests on different connections overlap. The worker
+    process is pinned to cpu unless it is None.
+    """
+    tune_for_timing(cpu, fifo)
     
-    print("\n2. Testing plain text message:")
-    test_plain_text()
+    # Encoded once; every request sends the same bytes
+    payload = call_payload()
+    buf = bytearray(4096)
+    socks = []
+    try:
+        for _ in range(connections):
+            sock = new_socket()
+            socks.append(sock)
+            sock.connect(addr)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            wait_for_lines(sock, buf, 1)  # welcome message
+        
+        return run_rounds(socks, payload, n_requests, buf)
+    finally:
+        for sock in socks:
+            sock.close()
+
+def run_load(total_requests: int, connections: int, pin: bool = False, fifo: bool = False):
+    """
+    Spread total_requests across one worker process per CPU and report
+    the aggregate throughput and latency distribution
+    
+    With pin, each worker is pinned to its own CPU; with fifo, workers
+    request SCHED_FIFO. Both are off by default, since the server's
+    workers run on the same CPUs.
+    """
+    # One worker per CPU this process may run on
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    workers = len(cpus)
+    try:
+        addr = resolve_addr()
+    except OSError as e:
+        print(f"Error: {e}")
+        return
+    shares = [total_requests // workers + (1 if i < total_requests % workers else 0) for i in range(workers)]
+    
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(
+            load_worker, shares, [addr] * workers, [connections] * workers,
+            cpus if pin else [None] * workers, [fifo] * workers
+        ))
+    elapsed = time.perf_counter() - start
+    
+    acked = sum(result[0] for result in results)
+    latencies = sorted(latency for result in results for latency in result[1])
+    
+    print(f"Load test: {acked}/{total_requests} requests acknowledged in {elapsed:.2f}s "
+          f"({acked / elapsed:.0f} req/s, {workers} processes x {connections} connections)")
+    if latencies:
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] / 1e6
+        print(f"Latency: p50 {percentile(0.50):.2f} ms, p99 {percentile(0.99):.2f} ms, "
+              f"max {latencies[-1] / 1e6:.2f} ms")
+
+def positive_int(value: str) -> int:
+    """
+    argparse type for counts that must be at least 1
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+async def main():
+    """
+    Open one connection (similar to 3cx socket component) and run the
+    tests over it
+    """
+    log = RunLog()
+    try:
+        with await open_test_socket(resolve_addr()) as sock:
+            log.add("Connected", f"{HOST}:{PORT}")
+            await run_tests(sock, log)
+    except OSError as e:
+        log.add("Error", str(e))
+    log.write()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--load", type=positive_int, metavar="N",
+                        help="send N requests from a process pool instead of running the tests")
+    parser.add_argument("--connections", type=positive_int, default=8, metavar="K",
+                        help="persistent connections per load worker process (default: 8)")
+    parser.add_argument("--pin", action="store_true",
+                        help="pin each load worker process to its own CPU (Linux only)")
+    parser.add_argument("--fifo", action="store_true",
+                        help="run load workers under SCHED_FIFO where permitted (Linux only)")
+    args = parser.parse_args()
     
-    print("\nTest completed!") 
\ No newline at end of file
+    if args.load:
+        run_load(args.load, args.connections, args.pin, args.fifo)
+    else:
+        print("Testing 3cx Call Flow Integration")
+        print("=" * 40)
+        
+        # Same libuv-backed loop as the server when it's installed
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        asyncio.run(main())
+        
+        print("\nTest completed!")